@@ -1,19 +1,19 @@
 import matplotlib
 import pandas as pd
+import numpy as np
 import joblib
 import matplotlib.pyplot as plt
 matplotlib.use('Agg')
 from sklearn.metrics import accuracy_score, f1_score
 from sklearn.model_selection import train_test_split
 
+from pipeline import feature_matrix, load_merged_data, map_quad_cat
+
 
 def compare_models():
     # 1. Prepare Test Data (Same as your previous logic)
-    ecg = pd.read_csv('ECG_FeaturesExtracted.csv')
-    eye = pd.read_csv('EyeTracking_FeaturesExtracted.csv')
-    data = pd.concat([eye, ecg.drop('Quad_Cat', axis=1)], axis=1)
-    mapping = {0: 4, 1: 3, 2: 1, 3: 2}
-    data['target_state'] = data['Quad_Cat'].map(mapping)
+    data = load_merged_data()
+    data['target_state'] = map_quad_cat(data['Quad_Cat'])
 
     _, test_data = train_test_split(data, test_size=0.2, random_state=42, stratify=data['target_state'])
 
@@ -28,7 +28,7 @@ def compare_models():
     for name, (path, features) in models_config.items():
         try:
             model = joblib.load(path)
-            X_test = test_data[features].fillna(0)
+            X_test = feature_matrix(test_data, features)
             y_pred = model.predict(X_test)
             results.append({'Model': name, 'Accuracy': accuracy_score(test_data['target_state'], y_pred)})
         except:
@@ -36,27 +36,25 @@ def compare_models():
 
     res_df = pd.DataFrame(results).sort_values('Accuracy', ascending=False)
 
-    plt.figure(figsize=(10, 7))
+    fig, ax = plt.subplots(figsize=(10, 7))
     colors = ['#4A90E2', '#5DA5DA', '#93C47D']
-    bars = plt.bar(res_df['Model'], res_df['Accuracy'], color=colors, edgecolor='black', alpha=0.8)
+    bars = ax.bar(res_df['Model'], res_df['Accuracy'], color=colors, edgecolor='black', alpha=0.8)
 
     plt.xticks(rotation=0, fontsize=11, fontweight='bold')
 
-    for bar in bars:
-        height = bar.get_height()
-        plt.text(bar.get_x() + bar.get_width() / 2., height + 0.01,
-                 f'{height:.2%}', ha='center', va='bottom', fontsize=12, fontweight='bold')
-
-    plt.axhline(y=0.25, color='red', linestyle='--', linewidth=2, label='Chance Level (25%)')
-    plt.title('Performance Comparison: Does Fusion Improve Classification?', fontsize=14, pad=20)
-    plt.ylabel('Classification Accuracy', fontsize=12)
-    plt.ylim(0, 0.5)
-    plt.grid(axis='y', linestyle=':', alpha=0.7)
-    plt.legend(loc='upper right')
-
-    plt.tight_layout()
-    plt.savefig('comparison_plot.png')
-    plt.show()
+    ax.bar_label(bars, labels=[f'{v:.2%}' for v in res_df['Accuracy']],
+                 padding=3, fontsize=12, fontweight='bold')
+
+    ax.axhline(y=0.25, color='red', linestyle='--', linewidth=2, label='Chance Level (25%)')
+    ax.set_title('Performance Comparison: Does Fusion Improve Classification?', fontsize=14, pad=20)
+    ax.set_ylabel('Classification Accuracy', fontsize=12)
+    ax.set_ylim(0, 0.5)
+    ax.grid(axis='y', linestyle=':', alpha=0.7)
+    ax.legend(loc='upper right')
+
+    fig.tight_layout()
+    fig.savefig('comparison_plot.png')
+    plt.close(fig)
 
 
 if __name__ == "__main__":
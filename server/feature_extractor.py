@@ -1,7 +1,110 @@
+import math
 import numpy as np
 import pandas as pd
 from typing import List, Dict, Any
 
+from flat_forest import njit
+
+# AOI sets used for membership tests, built once at import
+_NONE_AOI = frozenset({'NONE'})
+# Default content AOIs: paragraphs p1..p9
+_DEFAULT_CONTENT_AOIS = frozenset(f'p{i}' for i in range(1, 10))
+# Content AOIs (paragraphs) used for live windows
+_WINDOW_CONTENT_AOIS = frozenset({'p1', 'p2', 'p3', 'p4'})
+
+
+def _factorize_aois(items: List[Dict]):
+    """
+    Encode the 'aoi' of each item as an int32 code.
+    
+    Returns:
+    - (aoi_codes, aoi_uniques) where aoi_uniques[aoi_codes] gives back the AOI strings
+    """
+    aoi_codes, aoi_uniques = pd.factorize(
+        np.array([item.get('aoi', 'NONE') for item in items], dtype=object),
+        use_na_sentinel=False
+    )
+    aoi_uniques = np.asarray(aoi_uniques, dtype=object)
+    # factorize turns a null 'aoi' into NaN; give it back as None, as it was sent
+    aoi_uniques[pd.isna(aoi_uniques)] = None
+    return aoi_codes.astype(np.int32), aoi_uniques
+
+
+def _aoi_mask(aoi_uniques: np.ndarray, aois) -> np.ndarray:
+    """Boolean mask over aoi_uniques marking the codes whose AOI is in aois."""
+    return np.fromiter((aoi in aois for aoi in aoi_uniques), dtype=bool, count=len(aoi_uniques))
+
+
+def _gaze_arrays(gaze_points: List[Dict]):
+    """
+    Convert a gaze log into parallel NumPy arrays.
+    
+    Returns:
+    - (xs, ys, ts, aoi_codes, aoi_uniques) where aoi_uniques[aoi_codes] gives back the AOI strings
+    """
+    n = len(gaze_points)
+    xs = np.fromiter((p['x'] for p in gaze_points), dtype=np.float64, count=n)
+    ys = np.fromiter((p['y'] for p in gaze_points), dtype=np.float64, count=n)
+    ts = np.fromiter((p['t'] for p in gaze_points), dtype=np.float64, count=n)
+    aoi_codes, aoi_uniques = _factorize_aois(gaze_points)
+    return xs, ys, ts, aoi_codes, aoi_uniques
+
+
+@njit(cache=True)
+def _idt(xs, ys, ts, aois, d_thr, dur_thr, out_x, out_y, out_s, out_e, out_a):
+    """
+    I-DT kernel over parallel gaze arrays.
+    
+    Writes fixations into the preallocated out_* arrays and returns how many were written.
+    """
+    n = xs.shape[0]
+    written = 0
+    sum_x, sum_y, count = xs[0], ys[0], 1
+    start_t, end_t, cur_aoi = ts[0], ts[0], aois[0]
+    
+    for i in range(1, n + 1):
+        if i < n:
+            x, y = xs[i], ys[i]
+            if aois[i] == cur_aoi:
+                cx = sum_x / count
+                cy = sum_y / count
+                if math.sqrt((x - cx) ** 2 + (y - cy) ** 2) <= d_thr:
+                    # Add to current fixation
+                    sum_x += x
+                    sum_y += y
+                    count += 1
+                    end_t = ts[i]
+                    continue
+        
+        # Close the current fixation if it meets the duration threshold
+        if end_t - start_t >= dur_thr:
+            out_x[written] = sum_x / count
+            out_y[written] = sum_y / count
+            out_s[written] = start_t
+            out_e[written] = end_t
+            out_a[written] = cur_aoi
+            written += 1
+        
+        # Start new fixation
+        if i < n:
+            sum_x, sum_y, count = xs[i], ys[i], 1
+            start_t, end_t, cur_aoi = ts[i], ts[i], aois[i]
+    
+    return written
+
+
+def _detect_fixation_arrays(xs, ys, ts, aois, distance_threshold, duration_threshold):
+    """Run the I-DT kernel and return the (x, y, start, end, aoi_code) output arrays."""
+    n = len(xs)
+    out_x = np.empty(n, dtype=np.float64)
+    out_y = np.empty(n, dtype=np.float64)
+    out_s = np.empty(n, dtype=np.float64)
+    out_e = np.empty(n, dtype=np.float64)
+    out_a = np.empty(n, dtype=np.int32)
+    written = _idt(xs, ys, ts, aois, float(distance_threshold), float(duration_threshold),
+                   out_x, out_y, out_s, out_e, out_a)
+    return out_x[:written], out_y[:written], out_s[:written], out_e[:written], out_a[:written]
+
 
 def detect_fixations(gaze_points: List[Dict], distance_threshold: int = 50, duration_threshold: int = 100) -> List[Dict]:
     """
@@ -18,71 +121,26 @@ def detect_fixations(gaze_points: List[Dict], distance_threshold: int = 50, dura
     if len(gaze_points) == 0:
         return []
     
-    fixations = []
-    current_fixation = None
+    xs, ys, ts, aois, aoi_uniques = _gaze_arrays(gaze_points)
+    fx, fy, fs, fe, fa = _detect_fixation_arrays(xs, ys, ts, aois, distance_threshold, duration_threshold)
     
-    for point in gaze_points:
-        x, y, t = point['x'], point['y'], point['t']
-        aoi = point.get('aoi', 'NONE')
-        
-        if current_fixation is None:
-            current_fixation = {
-                'x': [x],
-                'y': [y],
-                'start': t,
-                'end': t,
-                'aoi': aoi
-            }
-        else:
-            # Calculate distance from fixation center
-            center_x = np.mean(current_fixation['x'])
-            center_y = np.mean(current_fixation['y'])
-            dist = np.sqrt((x - center_x)**2 + (y - center_y)**2)
-            
-            # Check if same AOI (for better grouping)
-            same_aoi = current_fixation.get('aoi') == aoi
-            
-            if dist <= distance_threshold and same_aoi:
-                # Add to current fixation
-                current_fixation['x'].append(x)
-                current_fixation['y'].append(y)
-                current_fixation['end'] = t
-            else:
-                # Check if previous fixation meets duration threshold
-                duration = current_fixation['end'] - current_fixation['start']
-                if duration >= duration_threshold:
-                    fixations.append({
-                        'x': np.mean(current_fixation['x']),
-                        'y': np.mean(current_fixation['y']),
-                        'start': current_fixation['start'],
-                        'end': current_fixation['end'],
-                        'duration': duration,
-                        'aoi': current_fixation.get('aoi', 'NONE')
-                    })
-                
-                # Start new fixation
-                current_fixation = {
-                    'x': [x],
-                    'y': [y],
-                    'start': t,
-                    'end': t,
-                    'aoi': aoi
-                }
-    
-    # Don't forget the last fixation
-    if current_fixation:
-        duration = current_fixation['end'] - current_fixation['start']
-        if duration >= duration_threshold:
-            fixations.append({
-                'x': np.mean(current_fixation['x']),
-                'y': np.mean(current_fixation['y']),
-                'start': current_fixation['start'],
-                'end': current_fixation['end'],
-                'duration': duration,
-                'aoi': current_fixation.get('aoi', 'NONE')
-            })
-    
-    return fixations
+    return [
+        {'x': x, 'y': y, 'start': s, 'end': e, 'duration': e - s, 'aoi': a}
+        for x, y, s, e, a in zip(fx.tolist(), fy.tolist(), fs.tolist(), fe.tolist(), aoi_uniques[fa].tolist())
+    ]
+
+
+# Compile the kernel at import so the first request doesn't pay for the JIT
+_detect_fixation_arrays(np.zeros(1), np.zeros(1), np.zeros(1), np.zeros(1, dtype=np.int32), 50, 100)
+
+
+def _saccade_duration(starts: np.ndarray, ends: np.ndarray) -> float:
+    """Mean positive gap between consecutive fixations, given their start/end arrays."""
+    # Time from end of fixation i to start of fixation i+1
+    saccade_durations = starts[1:] - ends[:-1]
+    saccade_durations = saccade_durations[saccade_durations > 0]
+    
+    return float(saccade_durations.mean()) if saccade_durations.size else 0.0
 
 
 def compute_saccade_duration(fixations: List[Dict]) -> float:
@@ -98,14 +156,17 @@ def compute_saccade_duration(fixations: List[Dict]) -> float:
     if len(fixations) < 2:
         return 0.0
     
-    saccade_durations = []
-    for i in range(len(fixations) - 1):
-        # Time from end of fixation i to start of fixation i+1
-        saccade_duration = fixations[i + 1]['start'] - fixations[i]['end']
-        if saccade_duration > 0:
-            saccade_durations.append(saccade_duration)
-    
-    return np.mean(saccade_durations) if saccade_durations else 0.0
+    n = len(fixations)
+    starts = np.fromiter((f['start'] for f in fixations), dtype=np.float64, count=n)
+    ends = np.fromiter((f['end'] for f in fixations), dtype=np.float64, count=n)
+    return _saccade_duration(starts, ends)
+
+
+def _reread_frequency(aoi_codes: np.ndarray, is_none: np.ndarray) -> int:
+    """Re-read count from factorized gaze AOIs; is_none marks the code of 'NONE'."""
+    # Every non-NONE point is either the first visit to its AOI or a re-read
+    on_aoi = aoi_codes[~is_none[aoi_codes]]
+    return int(on_aoi.size - np.unique(on_aoi).size)
 
 
 def calculate_reread_frequency(gaze_points: List[Dict]) -> int:
@@ -121,20 +182,17 @@ def calculate_reread_frequency(gaze_points: List[Dict]) -> int:
     if len(gaze_points) < 2:
         return 0
     
-    visited_aois = []
-    reread_count = 0
-    
-    for point in gaze_points:
-        aoi = point.get('aoi', 'NONE')
-        if aoi == 'NONE':
-            continue
-        
-        if aoi in visited_aois:
-            reread_count += 1
-        else:
-            visited_aois.append(aoi)
+    aoi_codes, aoi_uniques = _factorize_aois(gaze_points)
+    return _reread_frequency(aoi_codes, _aoi_mask(aoi_uniques, _NONE_AOI))
+
+
+def _env_fixation_ratio(fixation_codes: np.ndarray, is_content: np.ndarray, is_none: np.ndarray) -> float:
+    """Environment fixation ratio from factorized fixation AOIs and per-code content/'NONE' masks."""
+    if fixation_codes.size == 0:
+        return 0.0
     
-    return reread_count
+    env_fixations = np.count_nonzero(~(is_content | is_none)[fixation_codes])
+    return env_fixations / fixation_codes.size
 
 
 def calculate_env_fixation_ratio(fixations: List[Dict], content_aois: List[str] = None) -> float:
@@ -152,14 +210,11 @@ def calculate_env_fixation_ratio(fixations: List[Dict], content_aois: List[str]
     if len(fixations) == 0:
         return 0.0
     
-    if content_aois is None:
-        # Default: assume paragraphs (p1, p2, etc.) are content
-        content_aois = [f'p{i}' for i in range(1, 10)]
-    
-    env_fixations = sum(1 for f in fixations if f.get('aoi', 'NONE') not in content_aois and f.get('aoi') != 'NONE')
-    total_fixations = len(fixations)
+    # Default: assume paragraphs (p1, p2, etc.) are content
+    content = _DEFAULT_CONTENT_AOIS if content_aois is None else frozenset(content_aois)
     
-    return env_fixations / total_fixations if total_fixations > 0 else 0.0
+    aoi_codes, aoi_uniques = _factorize_aois(fixations)
+    return _env_fixation_ratio(aoi_codes, _aoi_mask(aoi_uniques, content), _aoi_mask(aoi_uniques, _NONE_AOI))
 
 
 def extract_features_from_window(window_data: Dict[str, Any]) -> Dict[str, float]:
@@ -179,25 +234,30 @@ def extract_features_from_window(window_data: Dict[str, Any]) -> Dict[str, float
     interactions = window_data.get('interactions', [])
     heart_rate = window_data.get('heart_rate', [])
     
+    # Convert the gaze log once; AOIs are factorized to int codes shared by every step below
+    xs, ys, ts, aoi_codes, aoi_uniques = _gaze_arrays(gaze_log)
+    is_none = _aoi_mask(aoi_uniques, _NONE_AOI)
+    
     # 1. Detect fixations using I-DT
-    fixations = detect_fixations(gaze_log)
+    if len(gaze_log) > 0:
+        _, _, fix_start, fix_end, fix_aoi = _detect_fixation_arrays(xs, ys, ts, aoi_codes, 50, 100)
+    else:
+        fix_start = fix_end = np.empty(0)
+        fix_aoi = np.empty(0, dtype=np.int32)
     
     # 2. Compute eye tracking features
-    if len(fixations) > 0:
-        mean_fixation_duration = np.mean([f['duration'] for f in fixations])
-        num_fixations = len(fixations)
-        mean_saccade_duration = compute_saccade_duration(fixations)
+    num_fixations = len(fix_start)
+    if num_fixations > 0:
+        mean_fixation_duration = np.mean(fix_end - fix_start)
+        mean_saccade_duration = _saccade_duration(fix_start, fix_end)
     else:
         mean_fixation_duration = 0.0
-        num_fixations = 0
         mean_saccade_duration = 0.0
     
     # 3. Compute derived features
-    reread_freq = calculate_reread_frequency(gaze_log)
+    reread_freq = _reread_frequency(aoi_codes, is_none) if len(gaze_log) >= 2 else 0
     
-    # Define content AOIs (paragraphs)
-    content_aois = ['p1', 'p2', 'p3', 'p4']
-    env_fixation_ratio = calculate_env_fixation_ratio(fixations, content_aois)
+    env_fixation_ratio = _env_fixation_ratio(fix_aoi, _aoi_mask(aoi_uniques, _WINDOW_CONTENT_AOIS), is_none)
     
     click_count = len([i for i in interactions if i.get('type') == 'click'])
     
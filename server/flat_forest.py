@@ -0,0 +1,84 @@
+import numpy as np
+
+try:
+    from numba import njit, prange
+    HAVE_NUMBA = True
+except ImportError:  # Numba is optional; fall back to the plain Python kernel
+    HAVE_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+def flatten_forest(model) -> dict:
+    """
+    Flatten a fitted RandomForestClassifier into flat node arrays (all trees concatenated).
+
+    Leaves point both children at themselves, so walking a tree for exactly its
+    depth lands on the same leaf whichever path is taken. Each split also keeps
+    sklearn's side for missing (NaN) values, so predict_flat() on the result gives
+    the same predictions as model.predict().
+    """
+    features, thresholds, children, missing_right, values, roots, depths = [], [], [], [], [], [], []
+    offset = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        is_leaf = tree.children_left == -1
+        nodes = np.arange(tree.node_count) + offset
+        roots.append(offset)
+        depths.append(tree.max_depth)
+
+        features.append(np.where(is_leaf, 0, tree.feature))
+        thresholds.append(np.where(is_leaf, 0, tree.threshold))
+        children.append(np.column_stack([
+            np.where(is_leaf, nodes, tree.children_left + offset),
+            np.where(is_leaf, nodes, tree.children_right + offset),
+        ]))
+        missing_right.append(np.where(is_leaf, 0, 1 - tree.missing_go_to_left.astype(np.int64)))
+        value = tree.value[:, 0, :]
+        values.append(value / value.sum(axis=1, keepdims=True))
+        offset += tree.node_count
+
+    return {
+        'roots': np.asarray(roots, dtype=np.int32),
+        'depths': np.asarray(depths, dtype=np.int32),
+        'feature': np.concatenate(features).astype(np.int32),
+        'threshold': np.concatenate(thresholds).astype(np.float64),
+        'children': np.ascontiguousarray(np.concatenate(children), dtype=np.int32),
+        'missing_right': np.concatenate(missing_right).astype(np.int8),
+        'value': np.concatenate(values).astype(np.float64),
+        'classes': np.asarray(model.classes_),
+    }
+
+
+@njit(parallel=True, cache=True)
+def _predict_votes(X, roots, depths, feature, threshold, children, missing_right, value):
+    n_samples = X.shape[0]
+    n_classes = value.shape[1]
+    votes = np.zeros((n_samples, n_classes), dtype=value.dtype)
+    for i in prange(n_samples):
+        for r in range(roots.shape[0]):
+            node = roots[r]
+            # The comparison picks the child column, and leaves loop onto themselves;
+            # NaN goes to the side sklearn recorded for the split
+            for _ in range(depths[r]):
+                x = X[i, feature[node]]
+                if np.isnan(x):
+                    node = children[node, missing_right[node]]
+                else:
+                    node = children[node, np.int64(x > threshold[node])]
+            for c in range(n_classes):
+                votes[i, c] += value[node, c]
+    return votes
+
+
+def predict_flat(flat, X) -> np.ndarray:
+    """Predict class labels for raw feature rows with a forest from flatten_forest()."""
+    # float32 inputs, as sklearn's trees compare them
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    votes = _predict_votes(X, flat['roots'], flat['depths'], flat['feature'], flat['threshold'],
+                           flat['children'], flat['missing_right'], flat['value'])
+    return flat['classes'][votes.argmax(axis=1)]
@@ -1,36 +1,20 @@
 import pandas as pd
 import numpy as np
-import joblib
 from sklearn.model_selection import train_test_split, StratifiedKFold, RandomizedSearchCV
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.metrics import accuracy_score
 
+from pipeline import (
+    EYE_TRACKING_CSV, EYE_TRACKING_COLUMNS,
+    feature_matrix, fit_search, map_quad_cat, save_baseline_model
+)
 
-def run_gaze_only_pipeline():
-    print("\n" + "=" * 60)
-    print("TRAINING BASELINE: GAZE FEATURES ONLY")
-    print("=" * 60)
 
-    # 1. LOAD & MERGE (Same logic as pipeline.py)
-    ecg = pd.read_csv('ECG_FeaturesExtracted.csv')
-    eye = pd.read_csv('EyeTracking_FeaturesExtracted.csv')
-    data = pd.concat([eye, ecg.drop('Quad_Cat', axis=1)], axis=1)
-
-    # 2. LABEL MAPPING
-    mapping = {0: 4, 1: 3, 2: 1, 3: 2}
-    data['target_state'] = data['Quad_Cat'].map(mapping)
-
-    # 3. FEATURE SELECTION (Gaze Only)
-    gaze_features = ['Mean_Fixation_Duration', 'Num_of_Fixations', 'Mean_Saccade_Duration']
-    X = data[gaze_features].fillna(0)
-    y = data['target_state']
+GAZE_FEATURES = ['Mean_Fixation_Duration', 'Num_of_Fixations', 'Mean_Saccade_Duration']
 
-    # 4. SPLIT
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y
-    )
 
-    # 5. TUNING
+def tune_model(X_train, y_train, n_jobs=-1):
+    """Run the hyperparameter search for the gaze-only baseline and return the fitted search."""
     cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
     param_dist = {
         'n_estimators': [300, 600, 1000],
@@ -39,20 +23,43 @@ def run_gaze_only_pipeline():
     }
 
     search = RandomizedSearchCV(
-        estimator=RandomForestClassifier(random_state=42, n_jobs=-1),
+        estimator=RandomForestClassifier(random_state=42, n_jobs=1),
         param_distributions=param_dist,
         n_iter=15,
         cv=cv,
         scoring='accuracy',
-        n_jobs=-1,
+        n_jobs=n_jobs,
         random_state=42
     )
 
-    search.fit(X_train, y_train)
-    best_model = search.best_estimator_
+    return fit_search(search, X_train, y_train)
+
+
+def run_gaze_only_pipeline():
+    print("\n" + "=" * 60)
+    print("TRAINING BASELINE: GAZE FEATURES ONLY")
+    print("=" * 60)
+
+    # 1. LOAD (Gaze columns only; the ECG file isn't needed here)
+    data = pd.read_csv(EYE_TRACKING_CSV, usecols=list(EYE_TRACKING_COLUMNS), dtype=EYE_TRACKING_COLUMNS)
+
+    # 2. LABEL MAPPING
+    data['target_state'] = map_quad_cat(data['Quad_Cat'])
+
+    # 3. FEATURE SELECTION (Gaze Only)
+    X = feature_matrix(data, GAZE_FEATURES)
+    y = data['target_state'].to_numpy(dtype=np.int8)
+
+    # 4. SPLIT
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42, stratify=y
+    )
+
+    # 5. TUNING
+    best_model = tune_model(X_train, y_train).best_estimator_
 
     # 6. SAVE
-    joblib.dump(best_model, 'gaze_only_model.pkl')
+    save_baseline_model(best_model, 'gaze_only_model.pkl')
     print(f"Gaze-Only Accuracy: {accuracy_score(y_test, best_model.predict(X_test)):.4f}")
 
 if __name__ == "__main__":
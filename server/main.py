@@ -1,11 +1,45 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 import joblib
-import pandas as pd
+import asyncio
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager, suppress
+import numpy as np
 import os
+from sklearn.ensemble import RandomForestClassifier
 from feature_extractor import extract_features_from_window
+from flat_forest import HAVE_NUMBA, flatten_forest, predict_flat
 
-app = FastAPI()
+try:
+    import onnxruntime as ort
+except ImportError:  # ONNX Runtime is optional; predictions fall back to sklearn
+    ort = None
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:  # orjson is optional; fall back to the stdlib parser
+    import json
+    json_loads = json.loads
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the prediction batching worker for the lifetime of the app."""
+    global _predict_queue, _batch_task
+    _predict_queue = asyncio.Queue()
+    _batch_task = asyncio.create_task(_batch_worker())
+    try:
+        yield
+    finally:
+        _batch_task.cancel()
+        with suppress(asyncio.CancelledError):
+            await _batch_task
+        _predict_queue = _batch_task = None
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Enable CORS for client requests
 app.add_middleware(
@@ -19,6 +53,15 @@ app.add_middleware(
 # Load model and metadata
 try:
     model = joblib.load('gaze_rf_model.pkl')
+    # Requests predict a single row; joblib worker dispatch would cost more than the
+    # tree traversal itself
+    model.n_jobs = 1
+    # Requests are fed as plain arrays in features_needed order, so drop the
+    # fitted column names to avoid sklearn's feature-name warning
+    model.feature_names_in_ = None
+    # sklearn recomputes feature_importances_ across all trees on every access.
+    # Gradient-boosted models (pipeline.py's hist_gradient_boosting family) have none
+    feature_importances = getattr(model, 'feature_importances_', None)
     features_needed = joblib.load('feature_list.pkl')
     STATE_LABELS = {1: "Focused Interest", 2: "Confusion", 3: "Frustration", 4: "Sleepiness"}
     
@@ -31,9 +74,65 @@ try:
 except Exception as e:
     print(f"CRITICAL: Could not load model files. Error: {e}")
     model = None
+    feature_importances = None
     features_needed = []
     model_metadata = None
 
+# Walk a flat-array copy of the forest with the Numba kernel, which gives
+# model.predict()'s results (NaN routing included) without its per-tree Python dispatch
+flat_forest = None
+if HAVE_NUMBA and isinstance(model, RandomForestClassifier):
+    try:
+        flat_forest = flatten_forest(model)
+        # Compile (or load the cached kernel) now rather than on the first request
+        predict_flat(flat_forest, np.zeros((1, model.n_features_in_), dtype=np.float32))
+    except Exception as e:
+        print(f"Warning: Could not build the Numba forest, using sklearn. Error: {e}")
+        flat_forest = None
+
+
+def _probe_rows(model, n_rows=2000, nan_share=0.1):
+    """
+    Random feature rows for checking a compiled model against model.predict().
+    
+    Values are drawn from each feature's split thresholds (nudged either side of them)
+    plus a share of NaNs, so rows land on both sides of the forest's splits.
+    """
+    rng = np.random.default_rng(0)
+    X = np.zeros((n_rows, model.n_features_in_), dtype=np.float32)
+    trees = [estimator.tree_ for estimator in getattr(model, 'estimators_', [])]
+    for j in range(model.n_features_in_):
+        thresholds = np.concatenate([[0.0]] + [tree.threshold[tree.feature == j] for tree in trees])
+        # Splits that only separate out NaNs have an infinite threshold
+        thresholds = thresholds[np.isfinite(thresholds)]
+        X[:, j] = rng.choice(thresholds, n_rows) + rng.normal(0.0, 1e-3, n_rows)
+    X[rng.random(X.shape) < nan_share] = np.nan
+    return X
+
+
+# Without Numba, use the compiled ONNX forest exported by pipeline.py, but only once it
+# reproduces model.predict() (its thresholds are float32). It is optional, so a missing
+# runtime, a bad export or a disagreeing one falls back to the pickled model
+onnx_session = None
+if flat_forest is None and model is not None and ort is not None and os.path.exists('gaze_rf_model.onnx'):
+    try:
+        onnx_session = ort.InferenceSession('gaze_rf_model.onnx', providers=['CPUExecutionProvider'])
+        onnx_input = onnx_session.get_inputs()[0].name
+        onnx_label = onnx_session.get_outputs()[0].name
+        probe = _probe_rows(model)
+        onnx_pred = onnx_session.run([onnx_label], {onnx_input: probe})[0]
+        if not np.array_equal(onnx_pred, model.predict(probe)):
+            print("Warning: gaze_rf_model.onnx disagrees with the pickled model, using the pickled model.")
+            onnx_session = None
+    except Exception as e:
+        print(f"Warning: Could not load gaze_rf_model.onnx, using the pickled model. Error: {e}")
+        onnx_session = None
+
+# The expected feature names are fixed once loaded, so lower-case them only once
+_FEATS = tuple(features_needed)
+_FEATS_LOWER = tuple(feat.lower() for feat in _FEATS)
+_N_FEATS = len(_FEATS)
+
 
 def prepare_features(input_dict: dict):
     """
@@ -44,21 +143,68 @@ def prepare_features(input_dict: dict):
     # e.g., {"bpm": 70} -> {"BPM": 70}
     clean_input = {str(k).lower(): v for k, v in input_dict.items()}
 
-    # 2. Reconstruct the feature set based on the exact names the model expects
-    ordered_data = {}
-    for feat in features_needed:
-        # Check if the feature (lowered) exists in our input
-        val = clean_input.get(feat.lower(), 0)
-        ordered_data[feat] = val
+    # 2. Build a single-row array in the exact column order the model expects
+    return np.fromiter(
+        (clean_input.get(feat, 0.0) for feat in _FEATS_LOWER), dtype=np.float32, count=_N_FEATS
+    ).reshape(1, _N_FEATS)
+
+
+def predict_rows(X):
+    """Predict state ids for a 2-D float32 feature array."""
+    if flat_forest is not None:
+        return predict_flat(flat_forest, X)
+    if onnx_session is not None:
+        return onnx_session.run([onnx_label], {onnx_input: X})[0]
+    return model.predict(X)
 
-    # 3. Create DataFrame with the explicit column order
-    return pd.DataFrame([ordered_data])[features_needed]
+
+# Micro-batching: rows from concurrent requests are stacked into a single
+# model.predict call, which costs barely more than predicting one row
+BATCH_MAX = 64
+_predict_queue = None
+_batch_task = None
+
+
+async def _batch_worker():
+    while True:
+        # No fixed wait: a lone request is predicted at once, and requests that
+        # arrive while a batch is being predicted are queued up for the next one
+        batch = [await _predict_queue.get()]
+        while len(batch) < BATCH_MAX and not _predict_queue.empty():
+            batch.append(_predict_queue.get_nowait())
+
+        rows, futures = zip(*batch)
+        try:
+            predictions = predict_rows(np.vstack(rows))
+        except Exception as e:
+            for fut in futures:
+                if not fut.done():
+                    fut.set_exception(e)
+            continue
+
+        for fut, pred in zip(futures, predictions):
+            if not fut.done():
+                fut.set_result(int(pred))
+
+
+async def predict_state(arr) -> int:
+    """
+    Predict the state id for a single prepared row, batched with any
+    other requests in flight.
+    """
+    if _predict_queue is None:
+        # Worker not running (e.g. app used without its lifespan)
+        return int(predict_rows(arr)[0])
+
+    fut = asyncio.get_running_loop().create_future()
+    await _predict_queue.put((arr, fut))
+    return await fut
 
 
 @app.post("/debug/predict-emotion")
 async def predict_emotion_only(features: dict):
-    df = prepare_features(features)
-    prediction = int(model.predict(df)[0])
+    arr = prepare_features(features)
+    prediction = await predict_state(arr)
 
     return {
         "status": "success",
@@ -67,21 +213,43 @@ async def predict_emotion_only(features: dict):
     }
 
 
+@app.post("/debug/predict-emotion-batch")
+async def predict_emotion_batch(rows: list[dict]):
+    """
+    Predict states for several feature dicts (e.g. buffered windows) in one call.
+    """
+    if not rows:
+        return {"status": "success", "predictions": []}
+
+    # One predict over the stacked rows instead of one per row
+    predictions = predict_rows(np.vstack([prepare_features(row) for row in rows]))
+
+    return {
+        "status": "success",
+        "predictions": [
+            {"state_id": int(pred), "label": STATE_LABELS.get(int(pred), "Unknown")}
+            for pred in predictions
+        ]
+    }
+
+
 @app.post("/debug/explain")
 async def explain_prediction(features: dict):
-    df = prepare_features(features)
-    prediction = int(model.predict(df)[0])
-
-    importances = model.feature_importances_
-    contributions = {}
-    for i, feat in enumerate(features_needed):
-        val = float(df[feat].iloc[0])
-        contributions[feat] = {
-            "value": val,
-            "impact_score": round(val * importances[i], 4)
-        }
+    if feature_importances is None:
+        return {"status": "error", "error": "Loaded model has no feature importances"}
+
+    arr = prepare_features(features)
+    prediction = await predict_state(arr)
 
-    sorted_drivers = sorted(contributions.items(), key=lambda x: x[1]['impact_score'], reverse=True)[:3]
+    values = arr[0].astype(np.float64)
+    impacts = values * feature_importances
+    contributions = {
+        feat: {"value": float(val), "impact_score": round(float(impact), 4)}
+        for feat, val, impact in zip(_FEATS, values, impacts)
+    }
+
+    top = np.argsort(-impacts, kind='stable')[:3]
+    sorted_drivers = [(_FEATS[i], contributions[_FEATS[i]]) for i in top]
 
     return {
         "prediction": STATE_LABELS.get(prediction),
@@ -90,8 +258,28 @@ async def explain_prediction(features: dict):
     }
 
 
+# Features of recently seen windows, keyed by a digest of the request body, so a
+# client retrying the same window doesn't pay for fixation detection again
+FEATURE_CACHE_SIZE = 128
+_feature_cache = OrderedDict()
+
+
+def cached_window_features(window_data: dict, body_digest: str) -> dict:
+    """Extract window features, reusing the result for a previously seen body."""
+    features = _feature_cache.get(body_digest)
+    if features is not None:
+        _feature_cache.move_to_end(body_digest)
+        return features
+
+    features = extract_features_from_window(window_data)
+    _feature_cache[body_digest] = features
+    if len(_feature_cache) > FEATURE_CACHE_SIZE:
+        _feature_cache.popitem(last=False)
+    return features
+
+
 @app.post("/analyze-window")
-async def analyze_window(window_data: dict):
+async def analyze_window(request: Request, response: Response):
     """
     Main endpoint for analyzing window data from client.
     Receives raw gaze, interaction, and heart rate data.
@@ -100,6 +288,15 @@ async def analyze_window(window_data: dict):
     import logging
     logger = logging.getLogger("uvicorn")
     
+    # Windows can carry thousands of gaze points, so parse the body with orjson directly
+    body = await request.body()
+    try:
+        window_data = json_loads(body)
+    except ValueError as e:
+        return {"status": "error", "error": f"Invalid JSON body: {e}"}
+    if not isinstance(window_data, dict):
+        return {"status": "error", "error": "Window data must be a JSON object"}
+    
     logger.info(f"Received window data: window_id={window_data.get('window_id')}, "
                 f"gaze_points={len(window_data.get('gaze_log', []))}, "
                 f"interactions={len(window_data.get('interactions', []))}, "
@@ -113,15 +310,18 @@ async def analyze_window(window_data: dict):
         }
     
     try:
-        # Extract features from raw window data
-        features = extract_features_from_window(window_data)
+        # Extract features from raw window data (the window_id alone isn't unique
+        # across client sessions, so the whole body is hashed)
+        body_digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        response.headers["ETag"] = f'"{body_digest}"'
+        features = cached_window_features(window_data, body_digest)
         logger.info(f"Extracted features: {features}")
         
         # Prepare features for model
-        df = prepare_features(features)
+        arr = prepare_features(features)
         
         # Predict
-        prediction = int(model.predict(df)[0])
+        prediction = await predict_state(arr)
         state_label = STATE_LABELS.get(prediction, "Unknown")
         
         logger.info(f"Prediction: {prediction} ({state_label})")
@@ -153,8 +353,8 @@ async def summarize_flow(payload: dict):
     text = payload.get("text", "")
     features = payload.get("features", {})
 
-    df = prepare_features(features)
-    prediction = int(model.predict(df)[0])
+    arr = prepare_features(features)
+    prediction = await predict_state(arr)
 
     # Determine if intervention is needed (Confusion=2, Frustration=3)
     should_act = prediction in [2, 3]
@@ -173,6 +373,8 @@ async def model_info():
     info = {
         "expected_features": features_needed,
         "model_type": str(type(model)) if model else "Not loaded",
+        "backend": ("onnxruntime" if onnx_session is not None
+                    else "numba" if flat_forest is not None else "sklearn"),
         "num_features": len(features_needed),
         "state_labels": STATE_LABELS
     }
@@ -1,14 +1,317 @@
 import pandas as pd
 import numpy as np
 import joblib
+import os
+from concurrent.futures import ThreadPoolExecutor
 from sklearn.model_selection import train_test_split, StratifiedKFold, RandomizedSearchCV, GridSearchCV
-from sklearn.ensemble import RandomForestClassifier
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
 from sklearn.metrics import classification_report, accuracy_score, confusion_matrix
+from scipy.stats import randint
 import warnings
 warnings.filterwarnings('ignore')
 
 
-def run_training_pipeline():
+def export_onnx(model, n_features, path):
+    """
+    Compile the fitted forest to ONNX so the server can run it with ONNX Runtime.
+    
+    Any previous export at path is removed first, since the server prefers it over
+    the pickle. Returns False when skl2onnx is not installed; conversion errors propagate.
+    """
+    if os.path.exists(path):
+        os.remove(path)
+
+    try:
+        from skl2onnx import convert_sklearn
+        from skl2onnx.common.data_types import FloatTensorType
+    except ImportError:
+        return False
+
+    onnx_model = convert_sklearn(
+        model,
+        initial_types=[('X', FloatTensorType([None, n_features]))],
+        options={id(model): {'zipmap': False}}
+    )
+    # Write next to the target and rename, so a failed write never leaves a partial export
+    with open(path + '.tmp', 'wb') as f:
+        f.write(onnx_model.SerializeToString())
+    os.replace(path + '.tmp', path)
+    return True
+
+
+# VREED Quad_Cat (0..3) to project state id, indexed by Quad_Cat:
+# 0->4 (Sleepy), 1->3 (Frustrated), 2->1 (Interest), 3->2 (Confusion)
+QUAD_CAT_TO_STATE = np.array([4, 3, 1, 2], dtype=np.int8)
+STATE_LABELS = {1: "Focused Interest", 2: "Confusion", 3: "Frustration", 4: "Sleepiness"}
+
+
+def map_quad_cat(quad_cat) -> np.ndarray:
+    """
+    Map VREED Quad_Cat values to project state ids.
+    
+    Raises ValueError for values outside 0..3 rather than letting them wrap around the table.
+    """
+    quad_cat = np.asarray(quad_cat)
+    out_of_range = (quad_cat < 0) | (quad_cat >= len(QUAD_CAT_TO_STATE))
+    if out_of_range.any():
+        raise ValueError(f"Unknown Quad_Cat values: {np.unique(quad_cat[out_of_range]).tolist()}")
+    return QUAD_CAT_TO_STATE[quad_cat]
+
+
+def feature_matrix(data, features) -> np.ndarray:
+    """
+    Select the feature columns as a C-contiguous float32 matrix, with NaN and +/-inf set to 0.
+    
+    float32 is sklearn's internal tree dtype, so fits neither re-validate nor copy it.
+    """
+    X = np.require(data[features].to_numpy(dtype=np.float32), requirements=['C', 'W'])
+    # Replace NaN and +/-inf values with 0 in place, in a single pass
+    if not np.isfinite(X).all():
+        print("   Warning: NaN/Inf values found, replacing with 0")
+        np.nan_to_num(X, copy=False, nan=0.0, posinf=0.0, neginf=0.0)
+    return X
+
+
+# Feature CSVs and the columns read from each, with the dtypes they are parsed as
+ECG_CSV = 'ECG_FeaturesExtracted.csv'
+EYE_TRACKING_CSV = 'EyeTracking_FeaturesExtracted.csv'
+ECG_COLUMNS = {'Bpm': 'float32'}
+EYE_TRACKING_COLUMNS = {'Quad_Cat': 'int8', 'Mean_Fixation_Duration': 'float32',
+                        'Num_of_Fixations': 'float32', 'Mean_Saccade_Duration': 'float32'}
+
+# Merged eye tracking + ECG columns, cached so re-runs skip CSV parsing
+MERGED_CACHE = 'merged_features.parquet'
+SOURCE_CSVS = [ECG_CSV, EYE_TRACKING_CSV]
+
+
+def load_cached_merge(path=MERGED_CACHE, sources=SOURCE_CSVS):
+    """
+    Load the merged feature frame from the Parquet cache.
+    
+    Returns None when the cache is missing, older than any source CSV, written with
+    other columns or dtypes than EYE_TRACKING_COLUMNS/ECG_COLUMNS, or no Parquet
+    engine (pyarrow/fastparquet) is installed.
+    """
+    if not os.path.exists(path):
+        return None
+    if os.path.getmtime(path) < max(os.path.getmtime(src) for src in sources):
+        return None
+    try:
+        data = pd.read_parquet(path)
+    except ImportError:
+        return None
+
+    # The mtime check misses edits to the column specs themselves
+    spec = {**EYE_TRACKING_COLUMNS, **ECG_COLUMNS}
+    if data.dtypes.astype(str).to_dict() != spec:
+        return None
+    return data
+
+
+def save_cached_merge(data, path=MERGED_CACHE):
+    """Write the merged feature frame to the Parquet cache; a no-op without a Parquet engine."""
+    try:
+        data.to_parquet(path, compression='snappy', index=False)
+    except ImportError:
+        pass
+
+
+def fit_search(search, X_train, y_train):
+    """
+    Fit a hyperparameter search with its workers capped to one BLAS/OpenMP thread each,
+    so the search's own n_jobs fills the cores instead of oversubscribing them.
+    
+    Returns the fitted search.
+    """
+    with joblib.parallel_backend('loky', inner_max_num_threads=1):
+        search.fit(X_train, y_train)
+    return search
+
+
+# Forest sizes compared by grow_forest(); the search itself uses the smallest
+TREE_COUNTS = [300, 600, 1000]
+
+
+def tune_model(X_train, y_train, n_jobs=-1, search_fraction=None):
+    """
+    Run the hyperparameter search for the fusion (gaze + HR) model.
+    
+    Returns the fitted search; n_jobs is the number of candidates/folds fitted in parallel.
+    With search_fraction set (e.g. 0.3), the search only sees a stratified subsample of
+    that share of the training rows. The search never refits a final model: grow_forest()
+    fits it on the full training set from best_params_.
+    """
+    if search_fraction is not None:
+        X_train, _, y_train, _ = train_test_split(
+            X_train, y_train, train_size=search_fraction, random_state=42, stratify=y_train
+        )
+
+    cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+
+    # Define parameter distributions for tuning (sampled, not enumerated as a grid).
+    # The tree count isn't searched: grow_forest() picks it afterwards with warm_start.
+    # With 4 features 'sqrt' and 0.5 both resolve to 2 features per split, so
+    # max_features only needs one of them (2 vs 3 features)
+    param_dist = {
+        'max_depth': [None, 10, 20, 30],
+        'min_samples_split': randint(2, 11),
+        'min_samples_leaf': randint(1, 5),
+        'max_features': ['sqrt', 0.75],
+        'bootstrap': [True],
+        'class_weight': ['balanced', 'balanced_subsample'],
+        'max_samples': [0.7, 0.9, None]
+    }
+    
+    # Base model (single-threaded: parallelism lives at the search level)
+    base_rf = RandomForestClassifier(
+        n_estimators=TREE_COUNTS[0],
+        random_state=42,
+        n_jobs=1
+    )
+    
+    # RandomizedSearchCV with 5-fold cross-validation
+    search = RandomizedSearchCV(
+        estimator=base_rf,
+        param_distributions=param_dist,
+        n_iter=50,
+        cv=cv,
+        scoring='accuracy',
+        refit=False,
+        n_jobs=n_jobs,
+        verbose=1,
+        random_state=42
+    )
+    
+    return fit_search(search, X_train, y_train)
+
+
+def tune_hist_gradient_boosting(X_train, y_train, n_jobs=-1):
+    """
+    Run the hyperparameter search for a HistGradientBoostingClassifier on the fusion features.
+    
+    Returns the fitted search; n_jobs is the number of candidates/folds fitted in parallel.
+    """
+    cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
+
+    # Small enough to enumerate: 24 candidates
+    param_grid = {
+        'learning_rate': [0.05, 0.1],
+        'max_iter': [100, 200],
+        'max_leaf_nodes': [15, 31, 63],
+        'min_samples_leaf': [10, 20],
+    }
+
+    search = GridSearchCV(
+        estimator=HistGradientBoostingClassifier(class_weight='balanced', random_state=42),
+        param_grid=param_grid,
+        cv=cv,
+        scoring='accuracy',
+        n_jobs=n_jobs,
+        verbose=1
+    )
+
+    return fit_search(search, X_train, y_train)
+
+
+def grow_forest(best_params, X_train, y_train, tree_counts=None):
+    """
+    Refit the tuned forest with warm_start, adding trees up to each count in
+    tree_counts instead of growing a new forest per count.
+    
+    Returns (model, oob_scores): the forest truncated to the count with the best
+    out-of-bag accuracy, and the OOB accuracy for every count tried.
+    """
+    tree_counts = sorted(tree_counts or TREE_COUNTS)
+    params = {k: v for k, v in best_params.items() if k != 'n_estimators'}
+    forest = RandomForestClassifier(**params, warm_start=True, oob_score=True, random_state=42, n_jobs=-1)
+
+    oob_scores = {}
+    for n_trees in tree_counts:
+        forest.set_params(n_estimators=n_trees)
+        forest.fit(X_train, y_train)
+        oob_scores[n_trees] = forest.oob_score_
+
+    # Ties go to the smaller forest. Its first n trees are exactly what a fresh
+    # fit with n_estimators=n would grow, so truncating is equivalent
+    best_n = max(oob_scores, key=oob_scores.get)
+    forest.estimators_ = forest.estimators_[:best_n]
+    forest.set_params(n_estimators=best_n, warm_start=False)
+    forest.oob_score_ = oob_scores[best_n]
+    del forest.oob_decision_function_
+    return forest, oob_scores
+
+
+def save_baseline_model(model, path):
+    """Save a fitted model for single-row serving (one job, compressed pickle)."""
+    # Single-row predictions at serving time are faster without joblib dispatch
+    model.n_jobs = 1
+    # Compressed: about 4x smaller on disk for ~10% more load time
+    joblib.dump(model, path, compress=3, protocol=5)
+
+
+def save_model_artifacts(best_model, features, metadata):
+    """
+    Save the fusion model, its feature list and training metadata for the server.
+    
+    Returns whether the ONNX export was written.
+    """
+    # Remove the previous export before writing the new pickle, so a failure in
+    # between never pairs the old ONNX model with the new forest
+    if os.path.exists('gaze_rf_model.onnx'):
+        os.remove('gaze_rf_model.onnx')
+    save_baseline_model(best_model, 'gaze_rf_model.pkl')
+    joblib.dump(features, 'feature_list.pkl')
+    joblib.dump(metadata, 'model_metadata.pkl')
+    return export_onnx(best_model, len(features), 'gaze_rf_model.onnx')
+
+
+def load_and_merge_csvs():
+    """
+    Read the eye tracking and ECG feature CSVs and join them column-wise.
+    
+    Only the columns used for training are parsed; GSR features are not
+    computable client-side, so the GSR file is not loaded at all.
+    """
+    # read_csv releases the GIL while parsing, so both files are read concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ecg_future = executor.submit(pd.read_csv, ECG_CSV, usecols=list(ECG_COLUMNS), dtype=ECG_COLUMNS)
+        eye_future = executor.submit(
+            pd.read_csv, EYE_TRACKING_CSV, usecols=list(EYE_TRACKING_COLUMNS), dtype=EYE_TRACKING_COLUMNS
+        )
+        ecg, eye = ecg_future.result(), eye_future.result()
+    print(f"   - Eye tracking: {len(eye)} samples")
+    print(f"   - ECG: {len(ecg)} samples")
+
+    # Files are row-aligned
+    if not eye.index.equals(ecg.index):
+        raise ValueError(f"Datasets are not row-aligned: {len(eye)} eye tracking vs {len(ecg)} ECG rows")
+    return pd.concat([eye, ecg], axis=1)
+
+
+def load_merged_data():
+    """
+    Load the merged eye tracking + ECG frame, from the Parquet cache when it is up to date.
+    
+    Otherwise the CSVs are read and merged, and the result is cached for the next run.
+    """
+    data = load_cached_merge()
+    if data is not None:
+        print(f"   - Merged features (cached in '{MERGED_CACHE}'): {len(data)} samples")
+        return data
+
+    data = load_and_merge_csvs()
+    save_cached_merge(data)
+    return data
+
+
+# Model families run_training_pipeline() can train, with their banner titles
+MODEL_FAMILIES = {
+    'random_forest': "RANDOM FOREST",
+    'hist_gradient_boosting': "HIST GRADIENT BOOSTING",
+}
+
+
+def run_training_pipeline(model_family='random_forest', search_fraction=None):
     """
     Retrained Random Forest pipeline with only computable features.
     Features that can be derived from client-side data:
@@ -18,39 +321,36 @@ def run_training_pipeline():
     Removed features (cannot be computed client-side):
     - Sdnn, Rmssd (require RR intervals, not available from Polar Verity Sense)
     - GSR features (require separate sensor hardware)
+    
+    Pass model_family='hist_gradient_boosting' to train a HistGradientBoostingClassifier
+    instead; it has no feature_importances_, so the server's /debug/explain is unavailable
+    for it.
+    search_fraction is passed to tune_model() to run the random forest search on a
+    stratified subsample (off by default: the VREED split has only ~250 training rows).
     """
+    if model_family not in MODEL_FAMILIES:
+        raise ValueError(f"Unknown model_family {model_family!r}, expected one of {tuple(MODEL_FAMILIES)}")
+
     print("=" * 60)
-    print("RANDOM FOREST TRAINING PIPELINE - COMPUTABLE FEATURES ONLY")
+    print(f"{MODEL_FAMILIES[model_family]} TRAINING PIPELINE - COMPUTABLE FEATURES ONLY")
     print("=" * 60)
     
-    # 1. LOAD DATA
-    print("\n[1/7] Loading datasets...")
-    ecg = pd.read_csv('ECG_FeaturesExtracted.csv')
-    eye = pd.read_csv('EyeTracking_FeaturesExtracted.csv')
-    gsr = pd.read_csv('GSR_FeaturesExtracted.csv')
-    print(f"   - Eye tracking: {len(eye)} samples")
-    print(f"   - ECG: {len(ecg)} samples")
-    print(f"   - GSR: {len(gsr)} samples")
-
-    # 2. MERGE FEATURES (Files are row-aligned)
-    print("\n[2/7] Merging datasets...")
-    data = pd.concat([eye, ecg.drop('Quad_Cat', axis=1), gsr.drop('Quad_Cat', axis=1)], axis=1)
+    # 1. LOAD & MERGE DATA (from the Parquet cache when it is newer than the CSVs)
+    print("\n[1/7] Loading and merging datasets...")
+    data = load_merged_data()
 
-    # 3. LABEL MAPPING (VREED to Project Labels)
-    # 0->4 (Sleepy), 1->3 (Frustrated), 2->1 (Interest), 3->2 (Confusion)
-    print("\n[3/7] Mapping labels...")
-    mapping = {0: 4, 1: 3, 2: 1, 3: 2}
-    data['target_state'] = data['Quad_Cat'].map(mapping)
+    # 2. LABEL MAPPING (VREED to Project Labels)
+    print("\n[2/7] Mapping labels...")
+    data['target_state'] = map_quad_cat(data['Quad_Cat'])
     
-    # Display label distribution
-    label_counts = data['target_state'].value_counts().sort_index()
-    label_names = {1: "Focused Interest", 2: "Confusion", 3: "Frustration", 4: "Sleepiness"}
+    # Display label distribution (state ids are 1..4, so bincount indexes them directly)
+    label_counts = np.bincount(data['target_state'].to_numpy(), minlength=5)
     print("   Label distribution:")
-    for label_id, count in label_counts.items():
-        print(f"   - {label_id} ({label_names[label_id]}): {count} samples")
+    for label_id, label_name in STATE_LABELS.items():
+        print(f"   - {label_id} ({label_name}): {label_counts[label_id]} samples")
 
-    # 4. FEATURE SELECTION - ONLY COMPUTABLE FEATURES
-    print("\n[4/7] Selecting computable features...")
+    # 3. FEATURE SELECTION - ONLY COMPUTABLE FEATURES
+    print("\n[3/7] Selecting computable features...")
     # Only features that can be computed from client-side raw data
     computable_features = [
         'Mean_Fixation_Duration',  # From I-DT algorithm on gaze data
@@ -68,102 +368,69 @@ def run_training_pipeline():
     for feat in computable_features:
         print(f"   - {feat}")
 
-    X = data[computable_features].fillna(0)
-    y = data['target_state']
-    
-    # Check for any remaining NaN or inf values
-    if X.isnull().any().any():
-        print("   Warning: NaN values found, filling with 0")
-        X = X.fillna(0)
-    if np.isinf(X).any().any():
-        print("   Warning: Inf values found, replacing with 0")
-        X = X.replace([np.inf, -np.inf], 0)
+    # Converted once, rather than letting every fit in the search validate and copy a DataFrame
+    X = feature_matrix(data, computable_features)
+    y = data['target_state'].to_numpy(dtype=np.int8)
 
-    # 5. TRAIN/TEST SPLIT
-    print("\n[5/7] Splitting data (80/20)...")
+    # 4. TRAIN/TEST SPLIT
+    print("\n[4/7] Splitting data (80/20)...")
     X_train, X_test, y_train, y_test = train_test_split(
         X, y, test_size=0.2, random_state=42, stratify=y
     )
     print(f"   Training set: {len(X_train)} samples")
     print(f"   Test set: {len(X_test)} samples")
 
-    # 6. HYPERPARAMETER TUNING
-    print("\n[6/7] Performing hyperparameter tuning with GridSearchCV...")
-    print("   This may take a few minutes...")
-    
-    cv = StratifiedKFold(n_splits=5, shuffle=True, random_state=42)
-
-    # Define parameter grid for tuning
-    param_dist = {
-        'n_estimators': [300, 600, 1000],
-        'max_depth': [None, 10, 20, 30],
-        'min_samples_split': [2, 5, 10],
-        'min_samples_leaf': [1, 2, 4],
-        'max_features': ['sqrt', 0.5, 0.75],
-        'bootstrap': [True],
-        'class_weight': ['balanced', 'balanced_subsample'],
-        'max_samples': [0.7, 0.9, None]
-    }
-    
-    # Base model
-    base_rf = RandomForestClassifier(
-        random_state=42,
-        n_jobs=-1,
-        oob_score=True
-    )
-    
-    # GridSearchCV with 5-fold cross-validation
-    search = RandomizedSearchCV(
-        estimator=base_rf,
-        param_distributions=param_dist,
-        n_iter=405,
-        cv=cv,
-        scoring='accuracy',
-        n_jobs=-1,
-        verbose=1,
-        random_state=42
-    )
+    # 5. HYPERPARAMETER TUNING
+    if model_family == 'hist_gradient_boosting':
+        print("\n[5/7] Performing hyperparameter tuning with GridSearchCV (HistGradientBoosting)...")
+        search = tune_hist_gradient_boosting(X_train, y_train)
+    else:
+        print("\n[5/7] Performing hyperparameter tuning with RandomizedSearchCV...")
+        print("   This may take a few minutes...")
+        search = tune_model(X_train, y_train, search_fraction=search_fraction)
     
-    search.fit(X_train, y_train)
-    
-    # Get best model
-    best_model = search.best_estimator_
-    best_params = search.best_params_
     best_score = search.best_score_
-    
     print(f"\n   Best cross-validation accuracy: {best_score:.4f}")
+    
+    if model_family == 'hist_gradient_boosting':
+        best_model = search.best_estimator_
+        best_params = search.best_params_
+    else:
+        # Get best model, growing it with warm_start to choose the number of trees
+        best_model, oob_scores = grow_forest(search.best_params_, X_train, y_train)
+        best_params = {**search.best_params_, 'n_estimators': best_model.n_estimators}
+        print("   Out-of-bag accuracy by number of trees:")
+        for n_trees, oob in oob_scores.items():
+            print(f"   - {n_trees}: {oob:.4f}")
+    
     print("   Best hyperparameters:")
     for param, value in best_params.items():
         print(f"   - {param}: {value}")
 
-    # 7. EVALUATE ON TEST SET
-    print("\n[7/7] Evaluating on test set...")
+    # 6. EVALUATE ON TEST SET
+    print("\n[6/7] Evaluating on test set...")
     y_pred = best_model.predict(X_test)
     test_accuracy = accuracy_score(y_test, y_pred)
     
     print(f"\n   Test Set Accuracy: {test_accuracy:.4f}")
     print("\n   Classification Report:")
     print(classification_report(y_test, y_pred, 
-                                target_names=[label_names[i] for i in sorted(label_names.keys())]))
+                                target_names=[STATE_LABELS[i] for i in sorted(STATE_LABELS)]))
     
     print("\n   Confusion Matrix:")
     cm = confusion_matrix(y_test, y_pred)
     print(f"{cm}")
     
-    # Feature importances
-    print("\n   Feature Importances:")
-    feature_importance = pd.DataFrame({
-        'feature': computable_features,
-        'importance': best_model.feature_importances_
-    }).sort_values('importance', ascending=False)
-    for _, row in feature_importance.iterrows():
-        print(f"   - {row['feature']}: {row['importance']:.4f}")
+    # Feature importances (random forest only; recomputed over all trees on every
+    # access, so read once)
+    importances = getattr(best_model, 'feature_importances_', None)
+    if importances is not None:
+        print("\n   Feature Importances:")
+        for i in np.argsort(-importances, kind='stable'):
+            print(f"   - {computable_features[i]}: {importances[i]:.4f}")
 
-    # 8. SAVE MODEL AND METADATA
-    print("\n[8/8] Saving model and metadata...")
-    joblib.dump(best_model, 'gaze_rf_model.pkl')
-    joblib.dump(computable_features, 'feature_list.pkl')
-    
+    # 7. SAVE MODEL AND METADATA
+    print("\n[7/7] Saving model and metadata...")
     # Save training metadata
     metadata = {
         'features': computable_features,
@@ -172,13 +439,18 @@ def run_training_pipeline():
         'test_accuracy': float(test_accuracy),
         'n_samples_train': len(X_train),
         'n_samples_test': len(X_test),
-        'label_mapping': label_names
+        'label_mapping': STATE_LABELS,
+        'model_family': model_family
     }
-    joblib.dump(metadata, 'model_metadata.pkl')
+    onnx_exported = save_model_artifacts(best_model, computable_features, metadata)
     
     print("   ✓ Model saved as 'gaze_rf_model.pkl'")
     print("   ✓ Feature list saved as 'feature_list.pkl'")
     print("   ✓ Metadata saved as 'model_metadata.pkl'")
+    if onnx_exported:
+        print("   ✓ ONNX model saved as 'gaze_rf_model.onnx'")
+    else:
+        print("   - skl2onnx not installed, skipped ONNX export")
     
     print("\n" + "=" * 60)
     print("TRAINING COMPLETE!")
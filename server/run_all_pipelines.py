@@ -0,0 +1,94 @@
+import os
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.model_selection import train_test_split
+from sklearn.metrics import accuracy_score
+
+import pipeline
+import gaze_only_pipeline
+import hr_only_pipeline
+
+
+def run_all_pipelines():
+    """
+    Train the fusion, gaze-only and HR-only models in a single run.
+    The CSVs are loaded and split once, then the three searches run side by side.
+    """
+    print("=" * 60)
+    print("TRAINING ALL MODELS (FUSION, GAZE ONLY, HR ONLY)")
+    print("=" * 60)
+
+    # 1. LOAD & MERGE (Files are row-aligned; shared loader with its Parquet cache)
+    print("\n[1/4] Loading datasets...")
+    data = pipeline.load_merged_data()
+
+    # 2. LABEL MAPPING (VREED to Project Labels)
+    data['target_state'] = pipeline.map_quad_cat(data['Quad_Cat'])
+
+    # 3. SPLIT ONCE (Same 80/20 split and random_state as the individual scripts)
+    print("\n[2/4] Splitting data (80/20)...")
+    fusion_features = gaze_only_pipeline.GAZE_FEATURES + hr_only_pipeline.HR_FEATURES
+    X = pipeline.feature_matrix(data, fusion_features)
+    y = data['target_state'].to_numpy(dtype=np.int8)
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42, stratify=y
+    )
+
+    # 4. TUNE ALL MODELS IN PARALLEL
+    # Each search gets an equal share of the cores; the forests themselves stay single-threaded.
+    # Only the fusion model is grown with warm_start and saved with the server's artifacts
+    configs = {
+        'Fusion (HR + Gaze)': (pipeline.tune_model, fusion_features, 'gaze_rf_model.pkl', True),
+        'Gaze Only': (gaze_only_pipeline.tune_model, gaze_only_pipeline.GAZE_FEATURES, 'gaze_only_model.pkl', False),
+        'HR Only': (hr_only_pipeline.tune_model, hr_only_pipeline.HR_FEATURES, 'hr_only_model.pkl', False),
+    }
+    # Column subsets of the split, each materialized once as its own contiguous array
+    columns = {
+        name: [fusion_features.index(feat) for feat in features]
+        for name, (_, features, _, _) in configs.items()
+    }
+    train_sets = {name: np.ascontiguousarray(X_train[:, cols]) for name, cols in columns.items()}
+    search_jobs = max(1, (os.cpu_count() or 1) // len(configs))
+    print(f"\n[3/4] Tuning {len(configs)} models in parallel ({search_jobs} jobs each)...")
+    searches = Parallel(n_jobs=len(configs), backend='loky')(
+        delayed(tune_model)(train_sets[name], y_train, n_jobs=search_jobs)
+        for name, (tune_model, _, _, _) in configs.items()
+    )
+
+    # 5. EVALUATE & SAVE
+    print("\n[4/4] Evaluating and saving models...")
+    for name, search in zip(configs, searches):
+        _, features, path, is_fusion = configs[name]
+        X_test_model = X_test[:, columns[name]]
+        best_params = search.best_params_
+        if is_fusion:
+            # The fusion search leaves the tree count to warm-start growing
+            best_model, _ = pipeline.grow_forest(best_params, train_sets[name], y_train)
+            best_params = {**best_params, 'n_estimators': best_model.n_estimators}
+        else:
+            best_model = search.best_estimator_
+        test_accuracy = accuracy_score(y_test, best_model.predict(X_test_model))
+        print(f"   - {name}: CV {search.best_score_:.4f}, Test {test_accuracy:.4f} -> '{path}'")
+
+        if is_fusion:
+            metadata = {
+                'features': features,
+                'best_params': best_params,
+                'cv_score': float(search.best_score_),
+                'test_accuracy': float(test_accuracy),
+                'n_samples_train': len(X_train),
+                'n_samples_test': len(X_test),
+                'label_mapping': pipeline.STATE_LABELS,
+                'model_family': 'random_forest'
+            }
+            pipeline.save_model_artifacts(best_model, features, metadata)
+        else:
+            pipeline.save_baseline_model(best_model, path)
+
+    print("\n" + "=" * 60)
+    print("TRAINING COMPLETE!")
+    print("=" * 60)
+
+
+if __name__ == "__main__":
+    run_all_pipelines()